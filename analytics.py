@@ -0,0 +1,229 @@
+import io
+import os
+import re
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from medicines import normalize_medicine_name
+
+ANALYTICS_DB = os.getenv('ANALYTICS_DB', 'analytics.db')
+
+# Column order written by save_to_csv()
+CSV_COLUMNS = [
+    'timestamp', 'patient_name', 'patient_age', 'doctor_name',
+    'date', 'diagnosis', 'medications', 'instructions'
+]
+MEDICATION_FIELDS = ['medicine_name', 'dosage', 'frequency', 'duration']
+
+# Aggregate tables, keyed by the dimension they count
+AGGREGATE_TABLES = {
+    'medicines': 'medicine',
+    'doctors': 'doctor',
+    'daily': 'day',
+    'diagnoses': 'diagnosis',
+}
+
+# Bump when the way prescriptions map to aggregate keys changes; databases built by
+# an older version are rebuilt from the CSV on the next start
+AGGREGATES_VERSION = 2
+
+DOCTOR_PREFIX_RE = re.compile(r'^\s*(?:dr|doctor)\b\.?\s*')
+DIAGNOSIS_SPLIT_RE = re.compile(r'[,;]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"] + [
+    statement
+    for table, key in AGGREGATE_TABLES.items()
+    for statement in (
+        f"CREATE TABLE IF NOT EXISTS {table} ({key} TEXT PRIMARY KEY, count INTEGER NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_count ON {table} (count DESC)",
+    )
+]
+
+
+def connect(db_path=None):
+    """Open the analytics database; WAL lets gunicorn workers read while one writes"""
+    conn = sqlite3.connect(db_path or ANALYTICS_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _clean(value):
+    """Normalize a free-text field for use as an aggregate key, or None if empty"""
+    if value is None or pd.isna(value):
+        return None
+    value = str(value).strip()
+    return value if value and value.upper() != 'N/A' else None
+
+
+def _doctor_key(doctor):
+    """Fold spelling variants such as 'Dr. Smith', 'DR SMITH' and 'Dr Smith' together"""
+    doctor = DOCTOR_PREFIX_RE.sub('', doctor.casefold())
+    return WHITESPACE_RE.sub(' ', doctor).strip() or None
+
+
+def _increments(prescription_data, timestamp):
+    """Yield (table, key) pairs that a single prescription adds one to"""
+    yield 'meta', 'total_prescriptions'
+    yield 'daily', timestamp[:10]
+
+    doctor = _clean(prescription_data.get('doctor_name'))
+    doctor = _doctor_key(doctor) if doctor else None
+    if doctor:
+        yield 'doctors', doctor
+
+    # "fever, cough" and "cough; fever" both count once towards fever and cough
+    diagnosis = _clean(prescription_data.get('diagnosis'))
+    diagnoses = set()
+    for part in DIAGNOSIS_SPLIT_RE.split(diagnosis or ''):
+        part = WHITESPACE_RE.sub(' ', part.casefold()).strip()
+        if part:
+            diagnoses.add(part)
+    for part in diagnoses:
+        yield 'diagnoses', part
+
+    medicines = set()
+    for med in prescription_data.get('medications', []):
+        name = _clean(med.get('medicine_name'))
+        if name:
+            medicines.add(normalize_medicine_name(name) or name.lower())
+    for medicine in medicines:
+        yield 'medicines', medicine
+
+
+def _apply(conn, prescription_data, timestamp):
+    """Upsert the aggregate counters for one prescription"""
+    for table, key in _increments(prescription_data, timestamp):
+        column = 'key' if table == 'meta' else AGGREGATE_TABLES[table]
+        value_column = 'value' if table == 'meta' else 'count'
+        conn.execute(
+            f"INSERT INTO {table} ({column}, {value_column}) VALUES (?, 1) "
+            f"ON CONFLICT({column}) DO UPDATE SET {value_column} = {value_column} + 1",
+            (key,)
+        )
+
+
+def parse_medications(medications_str):
+    """Split the flattened medications string from save_to_csv() back into dicts"""
+    medications = []
+    if not isinstance(medications_str, str):
+        return medications
+    for item in medications_str.split('; '):
+        if not item.strip():
+            continue
+        parts = item.rsplit(' - ', len(MEDICATION_FIELDS) - 1)
+        parts += ['N/A'] * (len(MEDICATION_FIELDS) - len(parts))
+        medications.append(dict(zip(MEDICATION_FIELDS, parts)))
+    return medications
+
+
+def read_prescriptions_csv(csv_path='prescriptions.csv'):
+    """Load the prescriptions CSV, tolerating an empty file or a missing header row"""
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return pd.DataFrame(columns=CSV_COLUMNS)
+    df = pd.read_csv(csv_path, header=None, names=CSV_COLUMNS, dtype=str, keep_default_na=False)
+    return df[df['timestamp'] != 'timestamp'].reset_index(drop=True)
+
+
+def _is_current(conn):
+    """Whether the aggregates were built by this version and have not been marked stale"""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'backfilled'").fetchone()
+    except sqlite3.OperationalError:
+        # Tables not created yet, e.g. init_db() failed at startup
+        return False
+    return row is not None and row[0] == AGGREGATES_VERSION
+
+
+def init_db(csv_path='prescriptions.csv', db_path=None):
+    """Create the aggregate tables and rebuild them from the CSV if they are not current
+
+    That covers a new database, one built by an older AGGREGATES_VERSION and one
+    flagged by mark_stale() after a failed incremental update.
+    """
+    with closing(connect(db_path)) as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+        # BEGIN IMMEDIATE so only one worker performs the rebuild
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not _is_current(conn):
+                conn.execute("DELETE FROM meta")
+                for table in AGGREGATE_TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+                for row in read_prescriptions_csv(csv_path).to_dict(orient='records'):
+                    row['medications'] = parse_medications(row['medications'])
+                    _apply(conn, row, row['timestamp'])
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('backfilled', ?)", (AGGREGATES_VERSION,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def mark_stale(db_path=None):
+    """Flag the aggregates for a rebuild after an update that failed to apply"""
+    with closing(connect(db_path)) as conn:
+        conn.execute("DELETE FROM meta WHERE key = 'backfilled'")
+
+
+def record_prescription(prescription_data, timestamp, db_path=None):
+    """Incrementally update the aggregates for a newly saved prescription"""
+    with closing(connect(db_path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _apply(conn, prescription_data, timestamp)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def get_summary(limit=10, db_path=None):
+    """Read the dashboard stats from the aggregate tables
+
+    Each list is a top-N read over an indexed table, so the cost depends on the
+    number of distinct keys returned rather than on the number of prescriptions.
+    Aggregates marked stale are rebuilt from the CSV first.
+    """
+    with closing(connect(db_path)) as conn:
+        current = _is_current(conn)
+    if not current:
+        init_db(db_path=db_path)
+
+    with closing(connect(db_path)) as conn:
+        total = conn.execute(
+            "SELECT value FROM meta WHERE key = 'total_prescriptions'"
+        ).fetchone()
+        summary = {'total_prescriptions': total[0] if total else 0}
+
+        for table, key in AGGREGATE_TABLES.items():
+            order = f"{key} DESC" if table == 'daily' else "count DESC"
+            rows = conn.execute(
+                f"SELECT {key}, count FROM {table} ORDER BY {order} LIMIT ?", (limit,)
+            ).fetchall()
+            summary[table] = [{key: k, 'count': count} for k, count in rows]
+    return summary
+
+
+def export_parquet(csv_path='prescriptions.csv'):
+    """Export prescriptions as Parquet, one row per medication, for offline analysis"""
+    df = read_prescriptions_csv(csv_path)
+    df['medications'] = df['medications'].apply(parse_medications)
+    df = df.explode('medications', ignore_index=True)
+    medications = pd.DataFrame(
+        [med if isinstance(med, dict) else {} for med in df.pop('medications')],
+        columns=MEDICATION_FIELDS
+    )
+    df = pd.concat([df, medications], axis=1)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    return buffer
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_file
 import openai
 import os
 import pandas as pd
@@ -6,6 +6,24 @@ from datetime import datetime
 import base64
 from dotenv import load_dotenv
 import json
+import re
+import shutil
+
+import analytics
+import cache
+from medicines import EXTRACTION_VERSION, resolve_medicine_mentions
+
+# Local OCR/NER pipeline (optional - tiered mode falls back to the vision model without it)
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+try:
+    import spacy
+except ImportError:
+    spacy = None
 
 load_dotenv()
 
@@ -16,6 +34,13 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Initialize OpenAI client
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Create the analytics aggregate tables, rebuilding them from prescriptions.csv if
+# needed. Analytics must not stop the app from starting; /analytics retries the rebuild.
+try:
+    analytics.init_db()
+except Exception as e:
+    print(f"Error initializing analytics: {e}")
+
 # Define prescription schema for structured output
 PRESCRIPTION_SCHEMA = {
     "type": "object",
@@ -45,12 +70,222 @@ PRESCRIPTION_SCHEMA = {
 # Chat conversation history
 conversation_history = []
 
+# Extraction mode: 'tiered' (local OCR + NER, vision model only for low-confidence scans),
+# 'local' (never call the vision model) or 'vision' (always call the vision model)
+EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'tiered').lower()
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv('LOCAL_CONFIDENCE_THRESHOLD', '0.75'))
+
+# Field patterns for the local pipeline, compiled once at import time.
+# Names stop at a run of spaces, a comma/semicolon/pipe or the next "Label:" on the
+# same line, e.g. "Patient Name: John Doe   Age: 45" gives "John Doe".
+_FIELD_END = r"(?=\s{2,}|\s*[,;|]|\s+\w+\s*:|[ \t]*$)"
+# A bare "Name:" label only counts at the start of a line, so "Doctor Name: Dr. A Kumar"
+# followed by "Patient Name: Ravi Kumar" gives "Ravi Kumar", not the doctor
+PATIENT_NAME_RE = re.compile(
+    r"(?:\bPatient(?:'s)?[ \t]+Name|\bPatient|^[ \t]*Name)[ \t]*:[ \t]*"
+    r"([A-Za-z][A-Za-z.]*(?: [A-Za-z.]+)*?)" + _FIELD_END,
+    re.IGNORECASE | re.MULTILINE
+)
+AGE_RE = re.compile(r"\bAge\s*[:\-]?\s*(\d{1,3})", re.IGNORECASE)
+DOCTOR_RE = re.compile(r"\b(Dr\.?[ \t]+[A-Z][A-Za-z.]*(?: [A-Za-z.]+)*?)" + _FIELD_END, re.MULTILINE)
+DATE_RE = re.compile(r"\b(\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4})\b")
+DIAGNOSIS_RE = re.compile(r"(?:Diagnosis|Dx)\s*[:\-]\s*(.+)", re.IGNORECASE)
+INSTRUCTIONS_RE = re.compile(r"(?:Instructions?|Advice)\s*[:\-]\s*(.+)", re.IGNORECASE)
+DOSAGE_RE = re.compile(r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|iu|units?)\b", re.IGNORECASE)
+FREQUENCY_RE = re.compile(
+    r"\b(?:once|twice|thrice|\d+\s*times)(?:\s+(?:a|per))?\s+day\b"
+    r"|\b(?:OD|BD|BID|TDS|TID|QID|QDS|HS|SOS|PRN)\b"
+    r"|\b[01]-[01]-[01]\b"
+    r"|\b(?:daily|at night|before meals|after meals)\b",
+    re.IGNORECASE
+)
+DURATION_RE = re.compile(r"\b\d+\s*(?:days?|weeks?|months?)\b", re.IGNORECASE)
+
+_nlp = None
+_nlp_loaded = False
+
 def encode_image(image_path):
     """Encode image to base64 for OpenAI API"""
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
+def get_nlp():
+    """Load the scispaCy model once per process, returning None if it is unavailable"""
+    global _nlp, _nlp_loaded
+    if not _nlp_loaded:
+        _nlp_loaded = True
+        if spacy is not None:
+            try:
+                _nlp = spacy.load("en_ner_bc5cdr_md")
+            except Exception as e:
+                # OSError (model not installed), ImportError (scispacy missing) or
+                # ValueError (model/spaCy version mismatch) all mean "use the vision model"
+                print(f"scispaCy model not available, local extraction disabled: {e}")
+    return _nlp
+
+def local_pipeline_available():
+    """Check whether Tesseract and the scispaCy model can be used"""
+    return local_pipeline_installed() and get_nlp() is not None
+
+def local_pipeline_installed():
+    """Cheap check for the local pipeline's packages and binary, without loading the model"""
+    return (
+        pytesseract is not None
+        and shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+        and spacy is not None
+        and spacy.util.is_package("en_ner_bc5cdr_md")
+    )
+
+# Logged once at startup so a deployment silently falling back to the vision model is visible
+if EXTRACTION_MODE != 'vision' and not local_pipeline_installed():
+    print(f"EXTRACTION_MODE={EXTRACTION_MODE} but pytesseract, the tesseract binary or the "
+          "en_ner_bc5cdr_md model is missing; every upload will use the vision model")
+
+def ocr_image(image_path):
+    """Run Tesseract once, returning the text and the mean word confidence (0-1)"""
+    data = pytesseract.image_to_data(Image.open(image_path), output_type=pytesseract.Output.DICT)
+    
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data['text']):
+        if not word.strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(key, []).append(word)
+        conf = float(data['conf'][i])
+        if conf >= 0:
+            confidences.append(conf)
+    
+    text = "\n".join(" ".join(words) for words in lines.values())
+    ocr_confidence = sum(confidences) / len(confidences) / 100 if confidences else 0.0
+    return text, ocr_confidence
+
+def _first_match(pattern, text):
+    """Return the first captured group (or whole match) of a pattern, or an empty string"""
+    match = pattern.search(text)
+    if not match:
+        return ""
+    return (match.group(1) if match.groups() else match.group(0)).strip()
+
+def _line_around(text, start, end):
+    """Return the full line of text containing the span [start, end)"""
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    return text[line_start:line_end if line_end != -1 else len(text)]
+
+def parse_prescription_text(text):
+    """Extract prescription fields from OCR text using scispaCy NER and regex patterns"""
+    doc = get_nlp()(text)
+    
+    # Gazetteer matches and NER chemicals with overlaps resolved. Medicines are stored
+    # as written; the canonical name only drops repeats of the same drug and regimen.
+    mentions = resolve_medicine_mentions(text, [
+        (ent.text, ent.start_char, ent.end_char)
+        for ent in doc.ents if ent.label_ == "CHEMICAL"
+    ])
+    medications = []
+    seen = set()
+    for canonical_name, written_name, start, end in mentions:
+        line = _line_around(text, start, end)
+        medication = {
+            "medicine_name": written_name,
+            "dosage": _first_match(DOSAGE_RE, line),
+            "frequency": _first_match(FREQUENCY_RE, line),
+            "duration": _first_match(DURATION_RE, line)
+        }
+        key = (canonical_name, medication["dosage"], medication["frequency"], medication["duration"])
+        if key in seen:
+            continue
+        seen.add(key)
+        medications.append(medication)
+    
+    diseases = []
+    for ent in doc.ents:
+        if ent.label_ == "DISEASE":
+            disease_name = ent.text.strip()
+            if len(disease_name) > 3 and disease_name not in diseases:
+                diseases.append(disease_name)
+    
+    return {
+        "patient_name": _first_match(PATIENT_NAME_RE, text),
+        "patient_age": _first_match(AGE_RE, text),
+        "doctor_name": _first_match(DOCTOR_RE, text),
+        "date": _first_match(DATE_RE, text),
+        "diagnosis": _first_match(DIAGNOSIS_RE, text) or ", ".join(diseases),
+        "medications": medications,
+        "instructions": _first_match(INSTRUCTIONS_RE, text)
+    }
+
+def score_local_extraction(prescription_data, ocr_confidence):
+    """Score a local extraction between 0 and 1
+
+    Required fields (patient name, at least one medicine) gate the score; the rest is
+    weighted between OCR confidence, optional header fields and medication dosages.
+    """
+    medications = prescription_data['medications']
+    if not prescription_data['patient_name'] or not medications:
+        return 0.0
+    
+    header_fields = ['doctor_name', 'date', 'patient_age']
+    field_score = sum(1 for f in header_fields if prescription_data[f]) / len(header_fields)
+    dosage_score = sum(1 for med in medications if med['dosage']) / len(medications)
+    return round(0.5 * ocr_confidence + 0.2 * field_score + 0.3 * dosage_score, 3)
+
+def extract_locally(image_path):
+    """Extract prescription data with the local OCR + NER pipeline, returning (data, confidence)"""
+    text, ocr_confidence = ocr_image(image_path)
+    if not text.strip():
+        return None, 0.0
+    prescription_data = parse_prescription_text(text)
+    return prescription_data, score_local_extraction(prescription_data, ocr_confidence)
+
 def extract_prescription_data(image_path):
+    """Extract prescription data, trying the local pipeline before the vision model
+
+    In 'tiered' mode the vision model is only called when the local extraction scores
+    below LOCAL_CONFIDENCE_THRESHOLD or the local pipeline is not installed. Results
+    are cached by image content and extraction settings in the shared cache, so every
+    worker reuses them and a settings change never serves a stale tier's result.
+    """
+    cache_key = cache.make_key(
+        EXTRACTION_VERSION, EXTRACTION_MODE, LOCAL_CONFIDENCE_THRESHOLD, cache.file_digest(image_path)
+    )
+    cached = cache.get('extraction', cache_key)
+    if cached is not None:
+        return cached
+    
+    prescription_data = _extract_uncached(image_path)
+    if 'error' not in prescription_data:
+        cache.put('extraction', cache_key, prescription_data)
+    return prescription_data
+
+def _extract_uncached(image_path):
+    """Run the configured extraction tiers for an image that is not in the cache"""
+    if EXTRACTION_MODE != 'vision' and local_pipeline_available():
+        try:
+            prescription_data, confidence = extract_locally(image_path)
+        except Exception as e:
+            print(f"Local extraction failed: {e}")
+            prescription_data, confidence = None, 0.0
+        
+        if prescription_data is not None and (
+            EXTRACTION_MODE == 'local' or confidence >= LOCAL_CONFIDENCE_THRESHOLD
+        ):
+            prescription_data['extraction_source'] = 'local'
+            prescription_data['extraction_confidence'] = confidence
+            return prescription_data
+        
+        if EXTRACTION_MODE == 'local':
+            return {"error": "Could not extract prescription data locally"}
+    elif EXTRACTION_MODE == 'local':
+        return {"error": "Local extraction requires pytesseract and the en_ner_bc5cdr_md model"}
+    
+    prescription_data = extract_with_vision(image_path)
+    if 'error' not in prescription_data:
+        prescription_data['extraction_source'] = 'vision'
+    return prescription_data
+
+def extract_with_vision(image_path):
     """Extract prescription data using OpenAI Vision API with structured output"""
     try:
         base64_image = encode_image(image_path)
@@ -106,8 +341,9 @@ def save_to_csv(prescription_data):
             for med in prescription_data.get('medications', [])
         ])
         
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         csv_data = {
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': timestamp,
             'patient_name': prescription_data.get('patient_name', 'N/A'),
             'patient_age': prescription_data.get('patient_age', 'N/A'),
             'doctor_name': prescription_data.get('doctor_name', 'N/A'),
@@ -125,6 +361,17 @@ def save_to_csv(prescription_data):
         else:
             df.to_csv('prescriptions.csv', mode='w', header=True, index=False)
         
+        # Keep the analytics aggregates in step with the CSV; if the update fails they
+        # are flagged stale and rebuilt from the CSV on the next read or start
+        try:
+            analytics.record_prescription(prescription_data, timestamp)
+        except Exception as e:
+            print(f"Error updating analytics: {e}")
+            try:
+                analytics.mark_stale()
+            except Exception as e:
+                print(f"Error marking analytics stale: {e}")
+        
         return True
     except Exception as e:
         print(f"Error saving to CSV: {e}")
@@ -194,15 +441,21 @@ def chat_send():
             }
         ] + conversation_history
         
-        # Get response from OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
+        # Reuse an answer to the same conversation from the shared cache
+        cache_key = cache.make_key("gpt-4o", messages)
+        assistant_message = cache.get('chat', cache_key)
         
-        assistant_message = response.choices[0].message.content
+        if assistant_message is None:
+            # Get response from OpenAI
+            response = openai.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            )
+            
+            assistant_message = response.choices[0].message.content
+            cache.put('chat', cache_key, assistant_message)
         
         # Add assistant response to history
         conversation_history.append({
@@ -237,6 +490,49 @@ def view_prescriptions():
         return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
+@app.route('/analytics')
+def view_analytics():
+    """Prescription stats from the precomputed aggregate tables"""
+    # Clamped so a dashboard query never turns into a full table scan
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    try:
+        return jsonify(analytics.get_summary(limit=limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analytics/export')
+def export_analytics():
+    """Download all prescriptions as Parquet, one row per medication"""
+    try:
+        buffer = analytics.export_parquet()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return send_file(
+        buffer,
+        mimetype='application/vnd.apache.parquet',
+        as_attachment=True,
+        download_name=f"prescriptions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet"
+    )
+
+def warm_up():
+    """Load everything a worker needs so its first request runs at steady-state latency"""
+    entries = cache.warm()
+    if EXTRACTION_MODE != 'vision':
+        get_nlp()
+    try:
+        analytics.get_summary()
+    except Exception as e:
+        print(f"Analytics warm-up failed: {e}")
+    local_status = 'disabled' if EXTRACTION_MODE == 'vision' else (
+        'available' if local_pipeline_available() else 'unavailable'
+    )
+    print(f"Warm-up complete: {entries} cache entries preloaded, local extraction {local_status}")
+
+# Warm-up fills this process's memory, so it has to run inside the serving process:
+# with gunicorn --preload it runs once in the master and forked workers inherit it
+if os.getenv('WARM_START', '').lower() in ('1', 'true', 'yes'):
+    warm_up()
+
 if __name__ == '__main__':
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     app.run(debug=True, port=5000)
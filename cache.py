@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+CACHE_DB = os.getenv('CACHE_DB', 'cache.db')
+# Entries kept in each process's in-memory tier in front of the shared SQLite file
+MEMORY_CACHE_SIZE = int(os.getenv('MEMORY_CACHE_SIZE', '1024'))
+
+# Default time-to-live per namespace in seconds (None = never expires)
+NAMESPACE_TTL = {
+    'extraction': 30 * 24 * 3600,
+    'fda': 7 * 24 * 3600,
+    'chat': 24 * 3600,
+}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_cache_created_at ON cache (created_at DESC)",
+]
+
+_memory = OrderedDict()
+_initialized = False
+
+
+def connect():
+    """Open the shared cache database; WAL lets all processes read while one writes"""
+    global _initialized
+    conn = sqlite3.connect(CACHE_DB, timeout=30)
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+def make_key(*parts):
+    """Build a stable cache key from JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    """SHA-256 of a file's contents, so re-uploads of the same scan share a key"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_digest(data):
+    """SHA-256 of in-memory file contents, e.g. a Streamlit upload"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _remember(namespace, key, payload, created_at):
+    """Store a JSON payload in the in-memory tier, evicting the least recently used
+
+    Payloads are kept serialized so every hit returns a fresh object that callers
+    can modify without corrupting the cache.
+    """
+    _memory[(namespace, key)] = (payload, created_at)
+    _memory.move_to_end((namespace, key))
+    while len(_memory) > MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def _expired(namespace, created_at):
+    ttl = NAMESPACE_TTL.get(namespace)
+    return ttl is not None and time.time() - created_at > ttl
+
+
+def get(namespace, key):
+    """Return a cached value, or None on a miss, checking memory before the shared file"""
+    entry = _memory.get((namespace, key))
+    if entry is not None:
+        if not _expired(namespace, entry[1]):
+            _memory.move_to_end((namespace, key))
+            return json.loads(entry[0])
+        del _memory[(namespace, key)]
+
+    try:
+        with closing(connect()) as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Cache read error: {e}")
+        return None
+
+    if row is None or _expired(namespace, row[1]):
+        return None
+    _remember(namespace, key, row[0], row[1])
+    return json.loads(row[0])
+
+
+def put(namespace, key, value):
+    """Store a JSON-serializable value in both cache tiers"""
+    created_at = time.time()
+    payload = json.dumps(value)
+    _remember(namespace, key, payload, created_at)
+    try:
+        with closing(connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, payload, created_at)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Cache write error: {e}")
+
+
+def warm(limit=None):
+    """Preload the most recent shared entries into this process's memory tier
+
+    Returns the number of entries loaded, or 0 if the cache file cannot be read; the
+    cache is only an optimization, so that must not stop a worker from starting.
+    Expired entries are pruned first so the file does not grow without bound across
+    deploys.
+    """
+    limit = limit or MEMORY_CACHE_SIZE
+    now = time.time()
+    try:
+        with closing(connect()) as conn:
+            for namespace, ttl in NAMESPACE_TTL.items():
+                if ttl is not None:
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND created_at < ?",
+                        (namespace, now - ttl)
+                    )
+            conn.commit()
+            rows = conn.execute(
+                "SELECT namespace, key, value, created_at FROM cache ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Cache warm-up error: {e}")
+        return 0
+
+    # Insert oldest first so the newest entries end up most recently used
+    for namespace, key, payload, created_at in reversed(rows):
+        _remember(namespace, key, payload, created_at)
+    return len(rows)
@@ -10,6 +10,9 @@ from PIL import Image
 import io
 import re
 
+import cache
+from medicines import EXTRACTION_VERSION, resolve_medicine_mentions
+
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
     layout="wide",
@@ -198,9 +201,14 @@ try:
 except Exception as e:
     pass
 
-# Load scispaCy Model
+# Load scispaCy Model and the shared cache once per process rather than on every rerun
+@st.cache_resource
+def load_resources():
+    cache.warm()
+    return spacy.load("en_ner_bc5cdr_md")
+
 try:
-    nlp = spacy.load("en_ner_bc5cdr_md")
+    nlp = load_resources()
 except OSError:
     st.error("⚠️ scispaCy 'en_ner_bc5cdr_md' model not found. Please install it first.")
     st.code("pip install https://s3-us-west-2.amazonaws.com/ai2-s2-scispacy/releases/v0.5.1/en_ner_bc5cdr_md-0.5.1.tar.gz")
@@ -246,26 +254,51 @@ def extract_entities(text):
     if name_match:
         patient_name = name_match.group(1).strip()
 
-    # Find Medicines and Diseases using scispaCy
+    # Find Medicines from the gazetteer and scispaCy, and Diseases using scispaCy.
+    # Names are canonicalized so variants of the same medicine share one FDA lookup.
     doc = nlp(text)
-    medicines = set()
+    medicines = {
+        name for name, _, _, _ in resolve_medicine_mentions(text, [
+            (ent.text, ent.start_char, ent.end_char)
+            for ent in doc.ents if ent.label_ == "CHEMICAL"
+        ])
+    }
     diseases = set()
     
     for ent in doc.ents:
-        if ent.label_ == "CHEMICAL":
-            medicine_name = ent.text.lower().strip()
-            if len(medicine_name) > 3 and medicine_name.replace(" ", "").isalnum():
-                medicines.add(medicine_name)
-        
-        elif ent.label_ == "DISEASE":
+        if ent.label_ == "DISEASE":
             disease_name = ent.text.strip()
             if len(disease_name) > 3:
                 diseases.add(disease_name)
                 
     return patient_name, list(medicines), list(diseases)
 
+def analyze_file(uploaded_file):
+    """Extracts text and entities, reusing results for the same file from the shared cache"""
+    # The extension picks the text extractor, so it is part of the key
+    file_type = uploaded_file.name.rsplit('.', 1)[-1].lower()
+    cache_key = cache.make_key(
+        'mediscan', EXTRACTION_VERSION, file_type, cache.bytes_digest(uploaded_file.getvalue())
+    )
+    cached = cache.get('extraction', cache_key)
+    if cached is not None:
+        return cached
+    
+    raw_text = extract_text_from_file(uploaded_file)
+    if not raw_text:
+        return raw_text, None, [], []
+    
+    patient_name, medicine_list, disease_list = extract_entities(raw_text)
+    result = [raw_text, patient_name, medicine_list, disease_list]
+    cache.put('extraction', cache_key, result)
+    return result
+
 def get_medicine_info(medicine_name):
-    """Fetches medicine information from OpenFDA API"""
+    """Fetches medicine information from OpenFDA API, via the shared cache"""
+    cached = cache.get('fda', medicine_name)
+    if cached is not None:
+        return cached
+    
     base_url = "https://api.fda.gov/drug/label.json"
     search_query = f'openfda.brand_name:"{medicine_name}"+openfda.generic_name:"{medicine_name}"'
     url = f"{base_url}?search=({search_query})&limit=1"
@@ -281,7 +314,9 @@ def get_medicine_info(medicine_name):
                 purpose = data['results'][0].get('indications_and_usage', [])
             
             if purpose:
-                return " ".join(purpose)[:400] + "..."
+                info = " ".join(purpose)[:400] + "..."
+                cache.put('fda', medicine_name, info)
+                return info
             
     except Exception as e:
         print(f"API Error for {medicine_name}: {e}")
@@ -303,9 +338,15 @@ def get_chatbot_response(context, question):
     Provide a clear, concise, and helpful answer.
     """
     
+    cache_key = cache.make_key('gemini-pro', context, question)
+    cached = cache.get('chat', cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         model = genai.GenerativeModel('gemini-pro')
         response = model.generate_content(prompt)
+        cache.put('chat', cache_key, response.text)
         return response.text
     except Exception as e:
         if "API_KEY_INVALID" in str(e) or "API_KEY" in str(e):
@@ -376,12 +417,10 @@ uploaded_file = st.file_uploader(
 
 if uploaded_file is not None and not st.session_state.analysis_done:
     with st.spinner('🔄 Analyzing your document... This may take a moment.'):
-        raw_text = extract_text_from_file(uploaded_file)
+        # Extract text and entities
+        raw_text, patient_name, medicine_list, disease_list = analyze_file(uploaded_file)
         
         if raw_text:
-            # Extract entities
-            patient_name, medicine_list, disease_list = extract_entities(raw_text)
-            
             st.success("✅ Analysis Complete!")
             
             # Analysis Results Section
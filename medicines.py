@@ -0,0 +1,173 @@
+import re
+
+# Version of the extraction pipelines, part of every 'extraction' cache key. Bump it
+# whenever this module, the field patterns in app.py or extract_entities() in main.py
+# change, so results cached by an older deploy are no longer served.
+EXTRACTION_VERSION = 1
+
+# Common generic medicine names used as a gazetteer alongside scispaCy NER
+KNOWN_MEDICINES = (
+    "acetaminophen", "aceclofenac", "acyclovir", "albendazole", "allopurinol", "alprazolam",
+    "albuterol", "amitriptyline", "amlodipine", "amoxicillin", "ampicillin", "aspirin", "atenolol", "atorvastatin", "azithromycin", "betamethasone", "bisoprolol", "budesonide", "carvedilol", "cefixime", "cefpodoxime", "ceftriaxone", "cefuroxime",
+    "cetirizine", "chlorpheniramine", "cholecalciferol", "ciprofloxacin", "clarithromycin", "clindamycin",
+    "clonazepam", "clopidogrel", "cyanocobalamin", "dexamethasone", "diazepam", "diclofenac", "digoxin",
+    "domperidone", "doxycycline", "empagliflozin", "enalapril", "esomeprazole", "famotidine",
+    "fexofenadine", "fluconazole", "fluoxetine", "folic acid", "furosemide", "gabapentin",
+    "gliclazide", "glimepiride", "glyburide", "hydrochlorothiazide", "hydrocortisone",
+    "hydroxychloroquine", "ibuprofen", "insulin glargine", "ivermectin", "ketorolac",
+    "lansoprazole", "levocetirizine", "levofloxacin", "levothyroxine", "linezolid",
+    "lisinopril", "loratadine", "losartan", "metformin", "methylprednisolone", "metoprolol",
+    "metronidazole", "montelukast", "naproxen", "nitrofurantoin", "ofloxacin", "olmesartan",
+    "omeprazole", "ondansetron", "pantoprazole", "prednisolone", "prednisone",
+    "pregabalin", "propranolol", "rabeprazole", "ramipril", "ranitidine", "rosuvastatin",
+    "sertraline", "simvastatin", "sitagliptin", "spironolactone", "telmisartan",
+    "tramadol", "valsartan", "vildagliptin", "warfarin",
+)
+
+# Brand and international names mapped to their generic (canonical) name.
+# Canonical names follow openFDA, e.g. paracetamol is indexed as acetaminophen.
+MEDICINE_ALIASES = {
+    "amoxicillin clavulanate": "amoxicillin and clavulanate potassium",
+    "amoxicillin clavulanic acid": "amoxicillin and clavulanate potassium",
+    "augmentin": "amoxicillin and clavulanate potassium",
+    "calpol": "acetaminophen",
+    "co amoxiclav": "amoxicillin and clavulanate potassium",
+    "crocin": "acetaminophen",
+    "dolo": "acetaminophen",
+    "ecosprin": "aspirin",
+    "glibenclamide": "glyburide",
+    "glycomet": "metformin",
+    "lipitor": "atorvastatin",
+    "paracetamol": "acetaminophen",
+    "salbutamol": "albuterol",
+    "tylenol": "acetaminophen",
+    "vitamin b12": "cyanocobalamin",
+    "vitamin d3": "cholecalciferol",
+    "zyrtec": "cetirizine",
+}
+
+# Short brand names are only resolved for NER mentions; in the gazetteer they would
+# match ordinary words such as "pan"
+SHORT_MEDICINE_ALIASES = {
+    "pan": "pantoprazole",
+    "pcm": "acetaminophen",
+}
+
+# Strength/dose tokens ("500 mg", "0.5%", "10ml") and standalone numbers
+STRENGTH_RE = re.compile(r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|µg|g|gm|ml|iu|units?|%)?(?=\W|$)", re.IGNORECASE)
+# Dosage-form words that are not part of the medicine name
+DOSAGE_FORM_RE = re.compile(
+    r"\b(?:tab|tabs|tablets?|cap|caps|capsules?|syp|syrup|susp|suspension|inj|injection"
+    r"|oint|ointment|cream|gel|lotion|drops?|sprays?|inhalers?|sachets?|sr|er|xr|cr|dt|mr|od)\b\.?",
+    re.IGNORECASE
+)
+NON_ALPHA_RE = re.compile(r"[^a-z0-9 ]+")
+WHITESPACE_RE = re.compile(r"\s+")
+TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+# Digits inside a word, e.g. "paracetam0l" but not "b12" or "d3"
+OCR_MIXED_TOKEN_RE = re.compile(r"[a-z]+\d[a-z\d]*[a-z]$")
+
+# Common OCR digit-for-letter confusions
+OCR_DIGIT_FIXES = str.maketrans({"0": "o", "1": "l", "5": "s", "8": "b"})
+
+MIN_MEDICINE_LENGTH = 4
+
+
+def _fix_ocr_token(token):
+    """Undo digit-for-letter OCR errors in a lowercase token such as 'paracetam0l'"""
+    if OCR_MIXED_TOKEN_RE.match(token):
+        return token.translate(OCR_DIGIT_FIXES)
+    return token
+
+
+def _build_trie(names):
+    """Build a token-level trie of medicine names; terminal nodes store the canonical name"""
+    trie = {}
+    for name, canonical in names:
+        node = trie
+        for token in name.split():
+            node = node.setdefault(token, {})
+        node[None] = canonical
+    return trie
+
+
+MEDICINE_TRIE = _build_trie(
+    [(name, name) for name in KNOWN_MEDICINES] + list(MEDICINE_ALIASES.items())
+)
+
+
+def clean_medicine_mention(text):
+    """Strip strengths and dosage forms from a mention, keeping it as written
+
+    "Tab. Crocin 650" gives "Crocin"; this is the name stored in extracted records,
+    while normalize_medicine_name() gives the key used for deduping and lookups.
+    """
+    text = DOSAGE_FORM_RE.sub(" ", STRENGTH_RE.sub(" ", text))
+    return WHITESPACE_RE.sub(" ", text).strip(" .,;:-")
+
+
+def normalize_medicine_name(name):
+    """Canonicalize a medicine mention, returning None if nothing usable remains
+
+    Strips strengths and dosage forms, fixes OCR digit confusions and maps brand
+    names to generics, so "Paracetamol 500", "Tab. paracetam0l" and "Crocin" all
+    become "acetaminophen".
+    """
+    name = DOSAGE_FORM_RE.sub(" ", STRENGTH_RE.sub(" ", name.lower()))
+    tokens = [_fix_ocr_token(token) for token in NON_ALPHA_RE.sub(" ", name).split()]
+    name = WHITESPACE_RE.sub(" ", " ".join(t for t in tokens if not t.isdigit())).strip()
+    if name in SHORT_MEDICINE_ALIASES:
+        return SHORT_MEDICINE_ALIASES[name]
+    if len(name) < MIN_MEDICINE_LENGTH:
+        return MEDICINE_ALIASES.get(name)
+    return MEDICINE_ALIASES.get(name, name)
+
+
+def match_known_medicines(text):
+    """Find gazetteer medicines in text, returning (canonical_name, start, end) spans
+
+    Walks the token trie from every token, keeping the longest match, so the scan is
+    linear in the number of tokens for the small depth of medicine names.
+    """
+    tokens = [
+        (_fix_ocr_token(m.group(0).lower()), m.start(), m.end())
+        for m in TOKEN_RE.finditer(text)
+    ]
+    matches = []
+    i = 0
+    while i < len(tokens):
+        node = MEDICINE_TRIE
+        best = None
+        j = i
+        while j < len(tokens) and tokens[j][0] in node:
+            node = node[tokens[j][0]]
+            j += 1
+            if None in node:
+                best = (node[None], j)
+        if best:
+            canonical, end_index = best
+            matches.append((canonical, tokens[i][1], tokens[end_index - 1][2]))
+            i = end_index
+        else:
+            i += 1
+    return matches
+
+
+def resolve_medicine_mentions(text, ner_mentions):
+    """Merge gazetteer matches with NER mentions into non-overlapping canonical spans
+
+    ner_mentions are (raw_text, start, end) spans from scispaCy. Gazetteer matches are
+    accepted first since they are already longest matches; an NER span is kept only if
+    it normalizes to a name and does not overlap an accepted span. Returns
+    (canonical_name, written_name, start, end) tuples sorted by position, where
+    written_name is the mention as written minus its strength.
+    """
+    accepted = match_known_medicines(text)
+    for raw_text, start, end in sorted(ner_mentions, key=lambda m: (m[1], m[1] - m[2])):
+        name = normalize_medicine_name(raw_text)
+        if name and not any(start < a_end and a_start < end for _, a_start, a_end in accepted):
+            accepted.append((name, start, end))
+    return [
+        (name, clean_medicine_mention(text[start:end]) or name, start, end)
+        for name, start, end in sorted(accepted, key=lambda m: m[1])
+    ]